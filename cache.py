@@ -0,0 +1,60 @@
+import hashlib
+import time
+from pathlib import Path
+
+import orjson
+
+
+class FileCache:
+    """Prompt-keyed response cache: an in-memory dict in front of JSON files.
+
+    Entries are stored under `<directory>/<md5(prompt)>.json` with a `ts`
+    timestamp and expire after `ttl` seconds. A bounded in-memory layer keeps
+    hot prompts from touching disk at all.
+    """
+
+    def __init__(self, directory: str = ".cache", ttl: float = 7 * 24 * 3600, max_memory_entries: int = 1024):
+        self.directory = Path(directory)
+        self.directory.mkdir(exist_ok=True)
+        self.ttl = ttl
+        self.max_memory_entries = max_memory_entries
+        self._mem = {}  # key -> (ts, text)
+
+    @staticmethod
+    def key_for(prompt: str) -> str:
+        return hashlib.md5(prompt.encode()).hexdigest()
+
+    def get(self, prompt: str) -> str | None:
+        """Returns the cached text for `prompt`, or None on a miss/expiry."""
+        key = self.key_for(prompt)
+        now = time.time()
+
+        hit = self._mem.get(key)
+        if hit and now - hit[0] < self.ttl:
+            return hit[1]
+
+        path = self.directory / f"{key}.json"
+        if path.exists():
+            try:
+                entry = orjson.loads(path.read_bytes())
+            except (OSError, ValueError):
+                return None
+            if now - entry["ts"] < self.ttl:
+                self._remember(key, entry["ts"], entry["text"])
+                return entry["text"]
+        return None
+
+    def set(self, prompt: str, text: str):
+        key = self.key_for(prompt)
+        ts = time.time()
+        try:
+            (self.directory / f"{key}.json").write_bytes(orjson.dumps({"ts": ts, "text": text}))
+        except OSError as e:
+            print(f"Error writing cache entry: {e}")
+        self._remember(key, ts, text)
+
+    def _remember(self, key: str, ts: float, text: str):
+        if key not in self._mem and len(self._mem) >= self.max_memory_entries:
+            # dicts preserve insertion order, so this evicts the oldest entry
+            self._mem.pop(next(iter(self._mem)))
+        self._mem[key] = (ts, text)
@@ -1,23 +1,37 @@
+import asyncio
 import os
+import secrets
+import time
 from typing import List
 
 import firebase_admin
 from fastapi import Body, FastAPI, HTTPException
-from firebase_admin import credentials, firestore
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from firebase_admin import credentials, firestore, firestore_async
 from google import genai
 from google.genai import types
 from google.genai.types import GenerateContentConfig, GoogleSearch, Tool
 from pydantic import BaseModel
 
-# Initialize Firebase Admin SDK
+# Initialize Firebase Admin SDK (idempotent so `uvicorn --reload` re-imports
+# don't raise "The default Firebase app already exists")
 cred = credentials.Certificate("serviceAccountKey.json")
-firebase_admin.initialize_app(cred)
-db = firestore.client()
+if not firebase_admin._apps:
+    firebase_admin.initialize_app(cred)
+db = None
 
 
 client = genai.Client(api_key=os.environ.get("GEMINI_API_KEY"))
 
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
+
+
+@app.on_event("startup")
+async def init_firestore():
+    # Created here rather than at import so each forked worker opens its own
+    # gRPC channel; channels created pre-fork break after fork
+    global db
+    db = firestore_async.client()
 
 # TODO: Move this to a config file and improve the prompt.
 FINANCIAL_SYSTEM_PROMPT = """
@@ -28,6 +42,14 @@ Dividend: If you want to park your money, invest in stocks with a high dividend.
 Answer accordingly in a polite way.
 Do not answer any other query about topics other than finance.
 """
+
+# Immutable request config, built once instead of per /chat call
+_SEARCH_TOOL = Tool(google_search=GoogleSearch())
+_GEN_CONFIG = GenerateContentConfig(
+    tools=[_SEARCH_TOOL],
+    response_modalities=["TEXT"],
+    system_instruction=FINANCIAL_SYSTEM_PROMPT,
+)
 class ChatRequest(BaseModel):
     userId: str
     message: str
@@ -35,41 +57,63 @@ class ChatRequest(BaseModel):
 
 
 def generate_chat_session_id():
-    return f"{int(os.times()[4] * 1000)}_{os.urandom(8).hex()}"
+    return f"{time.monotonic_ns()}_{secrets.token_hex(8)}"
 
 
 async def load_chat_history(user_id: str, chat_session_id: str) -> List[dict]:
     try:
         doc_ref = db.collection("chatHistory").document(user_id).collection("chatSessions").document(chat_session_id)
-        doc = doc_ref.get()
+        doc = await doc_ref.get()
         return doc.to_dict().get("history", []) if doc.exists else []
     except Exception as e:
         print(f"Error loading chat history: {e}")
         return []
 
-async def save_chat_history(user_id: str, chat_session_id: str, history: List[dict]):
+async def save_chat_history(user_id: str, chat_session_id: str, new_messages: List[dict]):
     try:
         doc_ref = db.collection("chatHistory").document(user_id).collection("chatSessions").document(chat_session_id)
-        doc_ref.set({"history": history})
+        # ArrayUnion appends server-side, so only the new turns go over the
+        # wire; merge=True creates the document on a session's first turn
+        await doc_ref.set({"history": firestore.ArrayUnion(new_messages)}, merge=True)
     except Exception as e:
         print(f"Error saving chat history: {e}")
 
 def history_to_types(history: List[dict]) -> List[types.Content]:
     return [types.Content(role=message["role"], parts=[types.Part.from_text(text=message["text"])]) for message in history]
 
-async def send_message_to_gemini(message: str, history: List[dict], prompt: str) -> str:
+
+# Converted-history cache keyed by chat session, so long conversations don't
+# rebuild O(N) types.Content objects on every turn; oldest session is evicted
+# past the cap
+_CONTENT_CACHE_MAX = 1024
+_content_cache = {}
+
+# Strong references to in-flight history saves: the event loop only holds a
+# weak reference to tasks, so fire-and-forget saves could otherwise be
+# garbage-collected before completing
+_save_tasks = set()
+
+
+def _remember_content(chat_session_id: str, content: List[types.Content]) -> List[types.Content]:
+    if chat_session_id not in _content_cache and len(_content_cache) >= _CONTENT_CACHE_MAX:
+        _content_cache.pop(next(iter(_content_cache)))
+    _content_cache[chat_session_id] = content
+    return content
+
+
+def _cached_content(chat_session_id: str, history: List[dict]) -> List[types.Content]:
+    cached = _content_cache.get(chat_session_id)
+    if cached is not None and len(cached) == len(history):
+        return cached
+    return _remember_content(chat_session_id, history_to_types(history))
+
+async def send_message_to_gemini(content: List[types.Content]):
+    """Returns an async iterator of response chunks from Gemini."""
     try:
-        google_search_tool = Tool(google_search = GoogleSearch())
-        content = history_to_types(history) + [types.Content(role="user", parts=[types.Part.from_text(text=message)])]
-        response = client.models.generate_content(model="gemini-2.0-flash",
-                                                config= GenerateContentConfig(
-                                                tools=[google_search_tool],
-                                                response_modalities=["TEXT"],
-                                                system_instruction=FINANCIAL_SYSTEM_PROMPT
-                                                ),  
+        return await client.aio.models.generate_content_stream(model="gemini-2.0-flash",
+                                                config=_GEN_CONFIG,
                                                 contents=content
                                                 )
-        return response.text
     except Exception as e:
         print(f"Error communicating with Gemini API: {e}")
         raise HTTPException(status_code=500, detail="Failed to communicate with Gemini API.")
@@ -79,10 +123,42 @@ async def send_message_to_gemini(message: str, history: List[dict], prompt: str)
 async def chat(request: ChatRequest):
     chat_session_id = request.chatSessionId or generate_chat_session_id()
     history = await load_chat_history(request.userId, chat_session_id)
-    response = await send_message_to_gemini(request.message, history, FINANCIAL_SYSTEM_PROMPT)
-    new_history = history + [{"role": "user", "text": request.message}, {"role": "model", "text": response}]
-    await save_chat_history(request.userId, chat_session_id, new_history)
-    return {"reply": response, "chatSessionId": chat_session_id}
+    content_prefix = _cached_content(chat_session_id, history)
+    user_content = types.Content(role="user", parts=[types.Part.from_text(text=request.message)])
+    stream = await send_message_to_gemini(content_prefix + [user_content])
+
+    async def reply_stream():
+        chunks = []
+        try:
+            async for event in stream:
+                if event.text:
+                    chunks.append(event.text)
+                    yield event.text
+        finally:
+            # Persist whatever was generated even if the client disconnects
+            # mid-stream; a stream that failed before producing any text saves
+            # nothing, so an empty model turn never reaches history or cache
+            if chunks:
+                reply = "".join(chunks)
+                new_messages = [
+                    {"role": "user", "text": request.message},
+                    {"role": "model", "text": reply},
+                ]
+                # Extend the typed-history cache with this turn so the next
+                # turn reuses it instead of reconverting the whole session
+                _remember_content(chat_session_id, content_prefix + [
+                    user_content,
+                    types.Content(role="model", parts=[types.Part.from_text(text=reply)]),
+                ])
+                task = asyncio.create_task(save_chat_history(request.userId, chat_session_id, new_messages))
+                _save_tasks.add(task)
+                task.add_done_callback(_save_tasks.discard)
+
+    return StreamingResponse(
+        reply_stream(),
+        media_type="text/plain",
+        headers={"X-Chat-Session-Id": chat_session_id},
+    )
 
 
 # Error Handling
@@ -95,4 +171,5 @@ def handle_exception(request, exc):
 if __name__ == "__main__":
     import uvicorn
 
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    uvicorn.run("main:app", host="0.0.0.0", port=8000,
+                workers=os.cpu_count(), loop="uvloop", http="httptools")
\ No newline at end of file